@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
+import re
+import glob
+import shutil
 import fnmatch
 from functools import total_ordering
 from conans.errors import ConanInvalidConfiguration, ConanException
@@ -58,6 +61,162 @@ class OpenSSLVersion(object):
             return 1
 
 
+# Configure targets to inherit from, keyed by "os-arch-compiler" patterns;
+# the first matching pattern wins, so more specific entries must come first
+_TARGETS = {
+    "Linux-x86-clang": "linux-x86-clang",
+    "Linux-x86_64-clang": "linux-x86_64-clang",
+    "Linux-x86-*": "linux-x86",
+    "Linux-x86_64-*": "%(prefix)slinux-x86_64",
+    "Linux-armv4-*": "linux-armv4",
+    "Linux-armv4i-*": "linux-armv4",
+    "Linux-armv5el-*": "linux-armv4",
+    "Linux-armv5hf-*": "linux-armv4",
+    "Linux-armv6-*": "linux-armv4",
+    "Linux-armv7-*": "linux-armv4",
+    "Linux-armv7hf-*": "linux-armv4",
+    "Linux-armv7s-*": "linux-armv4",
+    "Linux-armv7k-*": "linux-armv4",
+    "Linux-armv8-*": "linux-aarch64",
+    "Linux-armv8.3-*": "linux-aarch64",
+    "Linux-armv8-32-*": "linux-arm64ilp32",
+    "Linux-mips-*": "linux-mips32",
+    "Linux-mips64-*": "linux-mips64",
+    "Linux-ppc32-*": "linux-ppc32",
+    "Linux-ppc32le-*": "linux-pcc32",
+    "Linux-ppc32be-*": "linux-ppc32",
+    "Linux-ppc64-*": "linux-ppc64",
+    "Linux-ppc64le-*": "linux-ppc64le",
+    "Linux-pcc64be-*": "linux-pcc64",
+    "Linux-s390x-*": "linux64-s390x",
+    "Linux-e2k-*": "linux-generic64",
+    "Linux-sparc-*": "linux-sparcv8",
+    "Linux-sparcv9-*": "linux64-sparcv9",
+    "Linux-*-*": "linux-generic32",
+    "Macos-x86-*": "%(prefix)sdarwin-i386-cc",
+    "Macos-x86_64-*": "%(prefix)sdarwin64-x86_64-cc",
+    "Macos-ppc32-*": "%(prefix)sdarwin-ppc-cc",
+    "Macos-ppc32be-*": "%(prefix)sdarwin-ppc-cc",
+    "Macos-ppc64-*": "darwin64-ppc-cc",
+    "Macos-ppc64be-*": "darwin64-ppc-cc",
+    "Macos-*-*": "darwin-common",
+    "iOS-*-*": "iphoneos-cross",
+    "watchOS-*-*": "iphoneos-cross",
+    "tvOS-*-*": "iphoneos-cross",
+    # Android targets are very broken, see https://github.com/openssl/openssl/issues/7398
+    "Android-armv7-*": "linux-generic32",
+    "Android-armv7hf-*": "linux-generic32",
+    "Android-armv8-*": "linux-generic64",
+    "Android-x86-*": "linux-generic32",
+    "Android-x86_64-*": "linux-generic64",
+    "Android-mips-*": "linux-generic32",
+    "Android-mips64-*": "linux-generic64",
+    "Android-*-*": "linux-generic32",
+    "Windows-x86-gcc": "mingw",
+    "Windows-x86_64-gcc": "mingw64",
+    "Windows-*-gcc": "mingw-common",
+    "Windows-ia64-Visual Studio": "%(prefix)sVC-WIN64I",  # Itanium
+    "Windows-x86-Visual Studio": "%(prefix)sVC-WIN32",
+    "Windows-x86_64-Visual Studio": "%(prefix)sVC-WIN64A",
+    "Windows-armv7-Visual Studio": "VC-WIN32-ARM",
+    "Windows-armv8-Visual Studio": "VC-WIN64-ARM",
+    "Windows-*-Visual Studio": "VC-noCE-common",
+    "Windows-ia64-clang": "%(prefix)sVC-WIN64I",  # Itanium
+    "Windows-x86-clang": "%(prefix)sVC-WIN32",
+    "Windows-x86_64-clang": "%(prefix)sVC-WIN64A",
+    "Windows-armv7-clang": "VC-WIN32-ARM",
+    "Windows-armv8-clang": "VC-WIN64-ARM",
+    "Windows-*-clang": "VC-noCE-common",
+    "WindowsStore-x86-*": "VC-WIN32-UWP",
+    "WindowsStore-x86_64-*": "VC-WIN64A-UWP",
+    "WindowsStore-armv7-*": "VC-WIN32-ARM-UWP",
+    "WindowsStore-armv8-*": "VC-WIN64-ARM-UWP",
+    "WindowsStore-*-*": "VC-WIN32-ONECORE",
+    "WindowsCE-*-*": "VC-CE",
+    "SunOS-x86-gcc": "%(prefix)ssolaris-x86-gcc",
+    "SunOS-x86_64-gcc": "%(prefix)ssolaris64-x86_64-gcc",
+    "SunOS-sparc-gcc": "%(prefix)ssolaris-sparcv8-gcc",
+    "SunOS-sparcv9-gcc": "solaris64-sparcv9-gcc",
+    "SunOS-x86-suncc": "%(prefix)ssolaris-x86-cc",
+    "SunOS-x86_64-suncc": "%(prefix)ssolaris64-x86_64-cc",
+    "SunOS-sparc-suncc": "%(prefix)ssolaris-sparcv8-cc",
+    "SunOS-sparcv9-suncc": "solaris64-sparcv9-cc",
+    "SunOS-*-*": "solaris-common",
+    "*BSD-x86-*": "BSD-x86",
+    "*BSD-x86_64-*": "BSD-x86_64",
+    "*BSD-ia64-*": "BSD-ia64",
+    "*BSD-sparc-*": "BSD-sparcv8",
+    "*BSD-sparcv9-*": "BSD-sparcv9",
+    "*BSD-armv8-*": "BSD-generic64",
+    "*BSD-mips64-*": "BSD-generic64",
+    "*BSD-ppc64-*": "BSD-generic64",
+    "*BSD-ppc64le-*": "BSD-generic64",
+    "*BSD-ppc64be-*": "BSD-generic64",
+    "AIX-ppc32-gcc": "aix-gcc",
+    "AIX-ppc64-gcc": "aix64-gcc",
+    "AIX-pcc32-*": "aix-cc",
+    "AIX-ppc64-*": "aix64-cc",
+    "AIX-*-*": "aix-common",
+    "*BSD-*-*": "BSD-generic32",
+    "Emscripten-*-*": "cc",
+    "Neutrino-*-*": "BASE_unix",
+}
+
+# the patterns compiled once, in table order so the first match wins; they only use '*',
+# so they are translated by hand (fnmatch.translate output differs between Python versions)
+_TARGET_MATCHERS = [(pattern, re.compile("%s\\Z" % ".*".join(re.escape(token) for token in pattern.split("*"))))
+                    for pattern in _TARGETS]
+
+# OpenSSL < 1.1.0 has no dedicated x86 clang targets
+_TARGETS_1_0 = {
+    "Linux-x86-clang": "%(prefix)slinux-generic32",
+    "Linux-x86_64-clang": "%(prefix)slinux-x86_64",
+    "Linux-x86-*": "%(prefix)slinux-generic32",
+}
+
+_TARGETS_CYGWIN = {
+    "Windows-x86-gcc": "Cygwin-x86",
+    "Windows-x86_64-gcc": "Cygwin-x86_64",
+    "Windows-*-gcc": "Cygwin-common",
+}
+
+# asm module, perlasm scheme and bn_ops to add on top of ancestor targets that are C only,
+# e.g. darwin-common is used for Apple Silicon but has no aarch64 assembler enabled
+_ASM_TARGETS = {
+    ("Macos", "armv8"): ("aarch64_asm", "ios64", "SIXTY_FOUR_BIT_LP64 RC4_CHAR"),
+    ("Macos", "armv8.3"): ("aarch64_asm", "ios64", "SIXTY_FOUR_BIT_LP64 RC4_CHAR"),
+}
+
+# MSVC runtime flags in the makefiles generated for OpenSSL < 1.1.0, longest alternatives first
+_RUNTIME_REGEX = re.compile(r"/(MDd|MTd|MD|MT) ")
+
+# Perl configuration file for the conan target, written to Configurations/20-conan.conf
+_CONFIG_TEMPLATE = """{targets} = (
+    "{target}" => {{
+        inherit_from => [ "{ancestor}"{asm} ],
+        {perlasm_scheme}
+        {bn_ops}
+        cflags => add("{cflags}"),
+        cxxflags => add("{cxxflags}"),
+        {defines}
+        includes => add({includes}),
+        lflags => add("{lflags}"),
+        {cc}
+        {cxx}
+        {ar}
+        {ranlib}
+    }},
+);
+"""
+
+_WINDOWS_SYSTEM_LIBS = ("crypt32", "msi", "ws2_32", "advapi32", "user32", "gdi32")
+_LINUX_SYSTEM_LIBS = ("dl", "pthread")
+
+# environment variables read by Configure, changing any of them requires configuring again
+_CONFIGURE_ENV_VARS = ("CC", "CXX", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS", "LDLIBS", "AR", "RANLIB",
+                       "CROSS_COMPILE", "PERL")
+
+
 class OpenSSLConan(ConanFile):
     name = "openssl"
     settings = "os", "compiler", "arch", "build_type"
@@ -91,11 +250,18 @@ class OpenSSLConan(ConanFile):
                "no_async": [True, False],
                "no_dso": [True, False],
                "capieng_dialog": [True, False],
+               "neon": [True, False],
+               "enable_ec_nistp_64_gcc_128": [True, False],
                "openssldir": "ANY"}
-    default_options = {key: False for key in options.keys()}
-    default_options["fPIC"] = True
-    default_options["openssldir"] = None
+    default_options = dict(dict.fromkeys(options, False), fPIC=True, neon=True, enable_ec_nistp_64_gcc_128=True,
+                           openssldir=None)
+    # options passed through to Configure (e.g. no_md2 -> no-md2), in the same order as options.values.fields
+    _configure_options = tuple(sorted(set(options) - {"fPIC", "openssldir", "capieng_dialog", "neon",
+                                                      "enable_ec_nistp_64_gcc_128"}))
     _env_build = None
+    _target_name = None
+    _ancestor_target_name = None
+    _use_win_bash = None
     _source_subfolder = "sources"
 
     def build_requirements(self):
@@ -130,6 +296,15 @@ class OpenSSLConan(ConanFile):
             del self.options.capieng_dialog
         else:
             del self.options.fPIC
+        # NEON is optional only on 32-bit ARM, it is mandatory on AArch64 (armv8*)
+        arch = str(self.settings.arch)
+        if not arch.startswith("armv") or arch.startswith("armv8"):
+            del self.options.neon
+        # the 64-bit NIST curves implementation needs a little-endian 64-bit target and a compiler with __int128
+        if str(self.settings.os) not in ("Linux", "Macos") or \
+                str(self.settings.arch) not in ("x86_64", "armv8", "armv8.3", "ppc64le") or \
+                str(self.settings.compiler) not in ("gcc", "clang", "apple-clang"):
+            del self.options.enable_ec_nistp_64_gcc_128
 
     def requirements(self):
         if not self.options.no_zlib:
@@ -143,127 +318,31 @@ class OpenSSLConan(ConanFile):
 
     @property
     def _target(self):
-        target = "conan-%s-%s-%s-%s-%s" % (self.settings.build_type,
-                                           self.settings.os,
-                                           self.settings.arch,
-                                           self.settings.compiler,
-                                           self.settings.compiler.version)
-        if self.settings.compiler == "Visual Studio":
-            target = "VC-" + target  # VC- prefix is important as it's checked by Configure
-        if self.settings.os == "Windows" and self.settings.compiler == "gcc":
-            target = "mingw-" + target
-        return target
-
-    @property
-    def _targets(self):
-        is_cygwin = self.settings.get_safe("os.subsystem") == "cygwin"
-        is_1_0 = self._full_version < "1.1.0"
-        return {
-            "Linux-x86-clang": ("%slinux-generic32" % self._target_prefix) if is_1_0 else "linux-x86-clang",
-            "Linux-x86_64-clang": ("%slinux-x86_64" % self._target_prefix) if is_1_0 else "linux-x86_64-clang",
-            "Linux-x86-*": ("%slinux-generic32" % self._target_prefix) if is_1_0 else "linux-x86",
-            "Linux-x86_64-*": "%slinux-x86_64" % self._target_prefix,
-            "Linux-armv4-*": "linux-armv4",
-            "Linux-armv4i-*": "linux-armv4",
-            "Linux-armv5el-*": "linux-armv4",
-            "Linux-armv5hf-*": "linux-armv4",
-            "Linux-armv6-*": "linux-armv4",
-            "Linux-armv7-*": "linux-armv4",
-            "Linux-armv7hf-*": "linux-armv4",
-            "Linux-armv7s-*": "linux-armv4",
-            "Linux-armv7k-*": "linux-armv4",
-            "Linux-armv8-*": "linux-aarch64",
-            "Linux-armv8.3-*": "linux-aarch64",
-            "Linux-armv8-32-*": "linux-arm64ilp32",
-            "Linux-mips-*": "linux-mips32",
-            "Linux-mips64-*": "linux-mips64",
-            "Linux-ppc32-*": "linux-ppc32",
-            "Linux-ppc32le-*": "linux-pcc32",
-            "Linux-ppc32be-*": "linux-ppc32",
-            "Linux-ppc64-*": "linux-ppc64",
-            "Linux-ppc64le-*": "linux-ppc64le",
-            "Linux-pcc64be-*": "linux-pcc64",
-            "Linux-s390x-*": "linux64-s390x",
-            "Linux-e2k-*": "linux-generic64",
-            "Linux-sparc-*": "linux-sparcv8",
-            "Linux-sparcv9-*": "linux64-sparcv9",
-            "Linux-*-*": "linux-generic32",
-            "Macos-x86-*": "%sdarwin-i386-cc" % self._target_prefix,
-            "Macos-x86_64-*": "%sdarwin64-x86_64-cc" % self._target_prefix,
-            "Macos-ppc32-*": "%sdarwin-ppc-cc" % self._target_prefix,
-            "Macos-ppc32be-*": "%sdarwin-ppc-cc" % self._target_prefix,
-            "Macos-ppc64-*": "darwin64-ppc-cc",
-            "Macos-ppc64be-*": "darwin64-ppc-cc",
-            "Macos-*-*": "darwin-common",
-            "iOS-*-*": "iphoneos-cross",
-            "watchOS-*-*": "iphoneos-cross",
-            "tvOS-*-*": "iphoneos-cross",
-            # Android targets are very broken, see https://github.com/openssl/openssl/issues/7398
-            "Android-armv7-*": "linux-generic32",
-            "Android-armv7hf-*": "linux-generic32",
-            "Android-armv8-*": "linux-generic64",
-            "Android-x86-*": "linux-generic32",
-            "Android-x86_64-*": "linux-generic64",
-            "Android-mips-*": "linux-generic32",
-            "Android-mips64-*": "linux-generic64",
-            "Android-*-*": "linux-generic32",
-            "Windows-x86-gcc": "Cygwin-x86" if is_cygwin else "mingw",
-            "Windows-x86_64-gcc": "Cygwin-x86_64" if is_cygwin else "mingw64",
-            "Windows-*-gcc": "Cygwin-common" if is_cygwin else "mingw-common",
-            "Windows-ia64-Visual Studio": "%sVC-WIN64I" % self._target_prefix,  # Itanium
-            "Windows-x86-Visual Studio": "%sVC-WIN32" % self._target_prefix,
-            "Windows-x86_64-Visual Studio": "%sVC-WIN64A" % self._target_prefix,
-            "Windows-armv7-Visual Studio": "VC-WIN32-ARM",
-            "Windows-armv8-Visual Studio": "VC-WIN64-ARM",
-            "Windows-*-Visual Studio": "VC-noCE-common",
-            "Windows-ia64-clang": "%sVC-WIN64I" % self._target_prefix,  # Itanium
-            "Windows-x86-clang": "%sVC-WIN32" % self._target_prefix,
-            "Windows-x86_64-clang": "%sVC-WIN64A" % self._target_prefix,
-            "Windows-armv7-clang": "VC-WIN32-ARM",
-            "Windows-armv8-clang": "VC-WIN64-ARM",
-            "Windows-*-clang": "VC-noCE-common",
-            "WindowsStore-x86-*": "VC-WIN32-UWP",
-            "WindowsStore-x86_64-*": "VC-WIN64A-UWP",
-            "WindowsStore-armv7-*": "VC-WIN32-ARM-UWP",
-            "WindowsStore-armv8-*": "VC-WIN64-ARM-UWP",
-            "WindowsStore-*-*": "VC-WIN32-ONECORE",
-            "WindowsCE-*-*": "VC-CE",
-            "SunOS-x86-gcc": "%ssolaris-x86-gcc" % self._target_prefix,
-            "SunOS-x86_64-gcc": "%ssolaris64-x86_64-gcc" % self._target_prefix,
-            "SunOS-sparc-gcc": "%ssolaris-sparcv8-gcc" % self._target_prefix,
-            "SunOS-sparcv9-gcc": "solaris64-sparcv9-gcc",
-            "SunOS-x86-suncc": "%ssolaris-x86-cc" % self._target_prefix,
-            "SunOS-x86_64-suncc": "%ssolaris64-x86_64-cc" % self._target_prefix,
-            "SunOS-sparc-suncc": "%ssolaris-sparcv8-cc" % self._target_prefix,
-            "SunOS-sparcv9-suncc": "solaris64-sparcv9-cc",
-            "SunOS-*-*": "solaris-common",
-            "*BSD-x86-*": "BSD-x86",
-            "*BSD-x86_64-*": "BSD-x86_64",
-            "*BSD-ia64-*": "BSD-ia64",
-            "*BSD-sparc-*": "BSD-sparcv8",
-            "*BSD-sparcv9-*": "BSD-sparcv9",
-            "*BSD-armv8-*": "BSD-generic64",
-            "*BSD-mips64-*": "BSD-generic64",
-            "*BSD-ppc64-*": "BSD-generic64",
-            "*BSD-ppc64le-*": "BSD-generic64",
-            "*BSD-ppc64be-*": "BSD-generic64",
-            "AIX-ppc32-gcc": "aix-gcc",
-            "AIX-ppc64-gcc": "aix64-gcc",
-            "AIX-pcc32-*": "aix-cc",
-            "AIX-ppc64-*": "aix64-cc",
-            "AIX-*-*": "aix-common",
-            "*BSD-*-*": "BSD-generic32",
-            "Emscripten-*-*": "cc",
-            "Neutrino-*-*": "BASE_unix",
-        }
+        if not self._target_name:
+            target = "conan-%s-%s-%s-%s-%s" % (self.settings.build_type,
+                                               self.settings.os,
+                                               self.settings.arch,
+                                               self.settings.compiler,
+                                               self.settings.compiler.version)
+            if self.settings.compiler == "Visual Studio":
+                target = "VC-" + target  # VC- prefix is important as it's checked by Configure
+            if self.settings.os == "Windows" and self.settings.compiler == "gcc":
+                target = "mingw-" + target
+            self._target_name = target
+        return self._target_name
 
     @property
     def _ancestor_target(self):
+        if not self._ancestor_target_name:
+            self._ancestor_target_name = self._find_ancestor_target()
+        return self._ancestor_target_name
+
+    def _find_ancestor_target(self):
         if "CONAN_OPENSSL_CONFIGURATION" in os.environ:
             return os.environ["CONAN_OPENSSL_CONFIGURATION"]
         query = "%s-%s-%s" % (self.settings.os, self.settings.arch, self.settings.compiler)
-        ancestor = next((self._targets[i] for i in self._targets if fnmatch.fnmatch(query, i)), None)
-        if not ancestor:
+        pattern = next((i for i, regex in _TARGET_MATCHERS if regex.match(query)), None)
+        if not pattern:
             raise ConanInvalidConfiguration("unsupported configuration: %s %s %s, "
                                             "please open an issue: "
                                             "https://github.com/conan-community/community/issues. "
@@ -273,7 +352,13 @@ class OpenSSLConan(ConanFile):
                                             (self.settings.os,
                                             self.settings.arch,
                                             self.settings.compiler))
-        return ancestor
+        if self.settings.get_safe("os.subsystem") == "cygwin" and pattern in _TARGETS_CYGWIN:
+            ancestor = _TARGETS_CYGWIN[pattern]
+        elif self._full_version < "1.1.0" and pattern in _TARGETS_1_0:
+            ancestor = _TARGETS_1_0[pattern]
+        else:
+            ancestor = _TARGETS[pattern]
+        return ancestor % {"prefix": self._target_prefix}
 
     def _tool(self, env_name, apple_name):
         if env_name in os.environ:
@@ -315,9 +400,13 @@ class OpenSSLConan(ConanFile):
 
     @property
     def _configure_args(self):
-        openssldir = self.options.openssldir if self.options.openssldir else os.path.join(self.package_folder, "res")
-        prefix = tools.unix_path(self.package_folder) if self._win_bash else self.package_folder
-        openssldir = tools.unix_path(openssldir) if self._win_bash else openssldir
+        win_bash = self._win_bash
+        prefix = tools.unix_path(self.package_folder) if win_bash else self.package_folder
+        if self.options.openssldir:
+            openssldir = tools.unix_path(str(self.options.openssldir)) if win_bash else self.options.openssldir
+        else:
+            # reuse the already converted prefix rather than converting the path again
+            openssldir = "%s/res" % prefix if win_bash else os.path.join(prefix, "res")
         args = ['"%s"' % (self._target if self._full_version >= "1.1.0" else self._ancestor_target),
                 "shared" if self.options.shared else "no-shared",
                 "--prefix=%s" % prefix,
@@ -339,6 +428,8 @@ class OpenSSLConan(ConanFile):
                 args.append("-DOPENSSL_CAPIENG_DIALOG=1")
         else:
             args.append("-fPIC" if self.options.fPIC else "")
+        if self.options.get_safe("enable_ec_nistp_64_gcc_128"):
+            args.append("enable-ec_nistp_64_gcc_128")
 
         if "zlib" in self.deps_cpp_info.deps:
             zlib_info = self.deps_cpp_info["zlib"]
@@ -354,29 +445,13 @@ class OpenSSLConan(ConanFile):
             args.extend(['--with-zlib-include="%s"' % include_path,
                          '--with-zlib-lib="%s"' % lib_path])
 
-        for option_name in self.options.values.fields:
-            activated = getattr(self.options, option_name)
-            if activated and option_name not in ["fPIC", "openssldir", "capieng_dialog"]:
-                self.output.info("activated option: %s" % option_name)
-                args.append(option_name.replace("_", "-"))
+        activated = [option_name for option_name in self._configure_options if getattr(self.options, option_name)]
+        if activated:
+            self.output.info("activated options: %s" % ", ".join(activated))
+            args.extend(option_name.replace("_", "-") for option_name in activated)
         return args
 
     def _create_targets(self):
-        config_template = """{targets} = (
-    "{target}" => {{
-        inherit_from => [ "{ancestor}" ],
-        cflags => add("{cflags}"),
-        cxxflags => add("{cxxflags}"),
-        {defines}
-        includes => add({includes}),
-        lflags => add("{lflags}"),
-        {cc}
-        {cxx}
-        {ar}
-        {ranlib}
-    }},
-);
-"""
         cflags = []
 
         env_build = self._get_env_build()
@@ -396,26 +471,38 @@ class OpenSSLConan(ConanFile):
         defines = 'defines => add("%s"),' % defines if defines else ""
         ranlib = 'ranlib => "%s",' % ranlib if ranlib else ""
         targets = "my %targets" if self._full_version >= "1.1.1" else "%targets"
+        asm, perlasm_scheme, bn_ops = "", "", ""
+        asm_target = _ASM_TARGETS.get((str(self.settings.os), str(self.settings.arch)))
+        if asm_target and not self.options.no_asm and "CONAN_OPENSSL_CONFIGURATION" not in os.environ:
+            asm = ', asm("%s")' % asm_target[0]
+            perlasm_scheme = 'perlasm_scheme => "%s",' % asm_target[1]
+            bn_ops = 'bn_ops => "%s",' % asm_target[2]
         includes = ", ".join(['"%s"' % include for include in env_build.include_paths])
         if self.settings.os == "Windows":
             includes = includes.replace('\\', '/') # OpenSSL doesn't like backslashes
 
-        config = config_template.format(targets=targets,
-                                        target=self._target,
-                                        ancestor=self._ancestor_target,
-                                        cc=cc,
-                                        cxx=cxx,
-                                        ar=ar,
-                                        ranlib=ranlib,
-                                        cflags=" ".join(cflags),
-                                        cxxflags=" ".join(cxxflags),
-                                        defines=defines,
-                                        includes=includes,
-                                        lflags=" ".join(env_build.link_flags))
+        config = _CONFIG_TEMPLATE.format(targets=targets,
+                                         target=self._target,
+                                         ancestor=self._ancestor_target,
+                                         asm=asm,
+                                         perlasm_scheme=perlasm_scheme,
+                                         bn_ops=bn_ops,
+                                         cc=cc,
+                                         cxx=cxx,
+                                         ar=ar,
+                                         ranlib=ranlib,
+                                         cflags=" ".join(cflags),
+                                         cxxflags=" ".join(cxxflags),
+                                         defines=defines,
+                                         includes=includes,
+                                         lflags=" ".join(env_build.link_flags))
         self.output.info("using target: %s -> %s" % (self._target, self._ancestor_target))
         self.output.info(config)
 
-        tools.save(os.path.join(self._source_subfolder, "Configurations", "20-conan.conf"), config)
+        conan_conf = os.path.join(self._source_subfolder, "Configurations", "20-conan.conf")
+        # keep the file untouched if unchanged, otherwise make sees it newer than the Makefile and reconfigures
+        if not os.path.isfile(conan_conf) or tools.load(conan_conf) != config:
+            tools.save(conan_conf, config)
 
     def _run_make(self, targets=None, makefile=None, parallel=True):
         command = [self._make_program]
@@ -438,17 +525,34 @@ class OpenSSLConan(ConanFile):
             return os.path.join(self.deps_cpp_info["strawberryperl"].rootpath, "bin", "perl.exe")
         return "perl"
 
+    def _configure(self, args):
+        # re-running Configure regenerates the Makefile and forces a full rebuild, so skip it
+        # when neither its arguments, the conan target nor its environment have changed since the last run
+        command = '{perl} ./Configure {args}'.format(perl=self._perl, args=args)
+        conan_conf = os.path.join("Configurations", "20-conan.conf")
+        env = "\n".join("%s=%s" % (name, os.environ.get(name, "")) for name in _CONFIGURE_ENV_VARS)
+        stamp = tools.md5("\n".join([command,
+                                     tools.load(conan_conf) if os.path.isfile(conan_conf) else "",
+                                     env]))
+        stamp_file = ".conan_configure_stamp"
+        if os.path.isfile("Makefile") and os.path.isfile(stamp_file) and tools.load(stamp_file) == stamp:
+            self.output.info("Configure inputs unchanged, skipping Configure")
+            return
+
+        self.run(command, win_bash=self._win_bash)
+
+        self._patch_install_name()
+        tools.save(stamp_file, stamp)
+
     def _make(self):
         with tools.chdir(self._source_subfolder):
             # workaround for MinGW (https://github.com/openssl/openssl/issues/7653)
             if not os.path.isdir(os.path.join(self.package_folder, "bin")):
                 os.makedirs(os.path.join(self.package_folder, "bin"))
-            args = " ".join(self._configure_args)
-            self.output.info(self._configure_args)
-
-            self.run('{perl} ./Configure {args}'.format(perl=self._perl, args=args), win_bash=self._win_bash)
+            configure_args = self._configure_args
+            self.output.info(configure_args)
 
-            self._patch_install_name()
+            self._configure(" ".join(configure_args))
 
             if self.settings.compiler == "Visual Studio" and self._full_version < "1.1.0":
                 if not self.options.no_asm and self.settings.arch == "x86":
@@ -457,11 +561,8 @@ class OpenSSLConan(ConanFile):
                     self.run(r"ms\do_ms" if self.settings.arch == "x86" else r"ms\do_win64a")
                 makefile = r"ms\ntdll.mak" if self.options.shared else r"ms\nt.mak"
 
-                self._replace_runtime_in_file(os.path.join("ms", "nt.mak"))
-                self._replace_runtime_in_file(os.path.join("ms", "ntdll.mak"))
-                if self.settings.arch == "x86":
-                    tools.replace_in_file(os.path.join("ms", "nt.mak"), "-WX", "")
-                    tools.replace_in_file(os.path.join("ms", "ntdll.mak"), "-WX", "")
+                self._patch_ms_makefile(os.path.join("ms", "nt.mak"))
+                self._patch_ms_makefile(os.path.join("ms", "ntdll.mak"))
 
                 self._run_make(makefile=makefile)
                 self._run_make(makefile=makefile, targets=["install"], parallel=False)
@@ -496,11 +597,16 @@ class OpenSSLConan(ConanFile):
                     self._create_targets()
                 else:
                     self._patch_makefile_org()
+                if not self.options.get_safe("neon", True):
+                    self._patch_armcap()
                 self._make()
 
     @property
     def _win_bash(self):
-        return tools.os_info.is_windows and self.settings.os == "Windows" and  self.settings.compiler == "gcc"
+        if self._use_win_bash is None:
+            self._use_win_bash = tools.os_info.is_windows and self.settings.os == "Windows" and \
+                                 self.settings.compiler == "gcc"
+        return self._use_win_bash
 
     @property
     def _make_program(self):
@@ -518,16 +624,34 @@ class OpenSSLConan(ConanFile):
             makefile = "Makefile" if self._full_version >= "1.1.1" else "Makefile.shared"
             tools.replace_in_file(makefile, old_str, new_str, strict=self.in_local_cache)
 
-    def _replace_runtime_in_file(self, filename):
-        for e in ["MDd", "MTd", "MD", "MT"]:
-            tools.replace_in_file(filename, "/%s " % e, "/%s " % self.settings.compiler.runtime, strict=False)
+    def _patch_armcap(self):
+        # OpenSSL can't be configured without NEON, so skip the runtime CPU capabilities probe instead
+        # (it crashes with SIGILL on some ARMv7 cores), defaulting to none; they can still be enabled
+        # at runtime through the OPENSSL_armcap environment variable
+        tools.replace_in_file(os.path.join(self._source_subfolder, "crypto", "armcap.c"),
+                              'if ((e = getenv("OPENSSL_armcap"))) {',
+                              'if ((e = getenv("OPENSSL_armcap")) || (e = "0")) {',
+                              strict=self.in_local_cache)
+
+    def _patch_ms_makefile(self, filename):
+        content = tools.load(filename)
+        patched = _RUNTIME_REGEX.sub("/%s " % self.settings.compiler.runtime, content)
+        if self.settings.arch == "x86":
+            patched = patched.replace("-WX", "")
+        if patched != content:
+            tools.save(filename, patched)
 
     def package(self):
-        self.copy(src=self._source_subfolder, pattern="*LICENSE", dst="licenses")
-        for root, _, files in os.walk(self.package_folder):
-            for filename in files:
-                if fnmatch.fnmatch(filename, "*.pdb"):
-                    os.unlink(os.path.join(self.package_folder, root, filename))
+        # the license is at the top of the sources, don't let self.copy walk the whole source tree
+        licenses_folder = os.path.join(self.package_folder, "licenses")
+        tools.mkdir(licenses_folder)
+        for license_file in glob.glob(os.path.join(self._source_subfolder, "*LICENSE")):
+            shutil.copy(license_file, licenses_folder)
+        if str(self.settings.os).startswith("Windows"):
+            # debug databases are only produced by the MSVC-compatible toolchains
+            for root, _, files in os.walk(self.package_folder):
+                for filename in fnmatch.filter(files, "*.pdb"):
+                    os.unlink(os.path.join(root, filename))
         if self.settings.os == "Windows" and self.settings.compiler == "Visual Studio":
             if self.settings.build_type == 'Debug' and self._full_version >= "1.1.0":
                 with tools.chdir(os.path.join(self.package_folder, 'lib')):
@@ -547,6 +671,6 @@ class OpenSSLConan(ConanFile):
         else:
             self.cpp_info.libs = ["ssl", "crypto"]
         if self.settings.os == "Windows":
-            self.cpp_info.libs.extend(["crypt32", "msi", "ws2_32", "advapi32", "user32", "gdi32"])
+            self.cpp_info.libs.extend(_WINDOWS_SYSTEM_LIBS)
         elif self.settings.os == "Linux":
-            self.cpp_info.libs.extend(["dl", "pthread"])
+            self.cpp_info.libs.extend(_LINUX_SYSTEM_LIBS)